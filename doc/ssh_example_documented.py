@@ -54,13 +54,18 @@ async def test_some_remote_operations(found):
       print("Device {} has an ssh_connection with repr: {}".format(
           device.serial, device.ssh_connection))
 
-  # Now we're outside the sshify block, and the connection has been cleaned
-  # up for us.
+  # Now we're outside the sshify block, and the devices no longer have an
+  # ssh_connection. The connections themselves are kept in a pool so that a
+  # later sshify can reuse them.
   print("Outside sshify block")
   for device in found:
     print("Device {} has an ssh_connection with repr: {}".format(
         device.serial, device.ssh_connection))
 
+  # The pool is not cleaned up for us, close it on this loop before the loop
+  # itself is closed.
+  await faros_discovery.Remote.close_pool()
+
 
 def main():
   # get_all returns an iterator, which can only be consumed once in python.
@@ -72,7 +77,8 @@ def main():
   loop = asyncio.new_event_loop()
   # This will run until the given async task completes, returning whatever
   # that particular task returns. You can pass many tasks at once, which it
-  # will return in a list.
+  # will return in a list. The pooled ssh connections are closed by
+  # test_some_remote_operations before it returns.
   res = loop.run_until_complete(test_some_remote_operations(found))
   # Close the loop that we got to be nice to other people.
   loop.close()
@@ -135,7 +135,8 @@ if parsed.debug:
 else:
     logging.basicConfig(level=logging.INFO)
 
-top = Discover(soapy_enumerate_iterations=1, output=parsed.output, ipv6=parsed.prefer_ipv6, json_filename=parsed.json_filename)
+top = Discover(soapy_enumerate_iterations=1, output=parsed.output, ipv6=parsed.prefer_ipv6, json_filename=parsed.json_filename,
+               progress=lambda remote: logging.debug("Fetched status for %s", remote))
 top.set_options(yaml=parsed.yaml, json_out=parsed.json_out)
 if parsed.debug_trace:
     filename = DEFAULT_DEBUG_TRACE.format(str(datetime.datetime.now()).replace(" ", "_")) \
@@ -11,14 +11,17 @@
 import asyncio
 import datetime
 import logging
-import time
-import urllib
+import urllib.parse
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from functools import reduce, partial
+from functools import lru_cache
+from operator import attrgetter
 from types import MethodType
+from typing import Tuple
 import json
 import ipaddress
+import itertools
 import os
 
 import aiohttp
@@ -46,14 +49,84 @@ except ImportError as e:
         )
         raise e
 
+try:
+    # Optional, considerably faster than json for the device status blobs.
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
 
+@lru_cache(maxsize=512)
 def is_ipv4(address: str) -> bool:
+    # IPv6 addresses and empty hosts never parse, skip raising for them.
+    if not address or ":" in address:
+        return False
     try:
         return ipaddress.IPv4Address(address) is not None
     except ipaddress.AddressValueError:
         return False
 
 
+@lru_cache(maxsize=512)
+def _parse_remote_url(remote: str, path: str = None) -> Tuple[str, str, str]:
+    """
+        Returns the (address, ip_address, json_url) for a soapy remote url.
+        The path of the json url is replaced when one is given.
+        """
+    url = urllib.parse.urlsplit(remote)
+    address = ip_address = url.hostname
+    # Annoying hack, aiohttp requires braces on URLs, asyncssh requires
+    # they not be present, and urllib has no facilities for injecting and
+    # removing them.
+    if not is_ipv4(address):
+        address = "[" + address + "]"
+    json_url = urllib.parse.urlunsplit(
+        ("http", address, url.path if path is None else path, url.query, url.fragment))
+    return address, ip_address, json_url
+
+
+# Location of the rrh serial in the json status, only present on rrh heads.
+_RRH_SERIAL_PATH = ("sfp", "config", "rrh", "serial")
+
+
+def _in_running_loop():
+    try:
+        get_running_loop = asyncio.get_running_loop
+    except AttributeError:
+        # Python 3.6 has no get_running_loop.
+        try:
+            return asyncio.get_event_loop().is_running()
+        except RuntimeError:
+            return False
+    try:
+        get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _run_coroutine(coro):
+    """
+        Runs coro to completion on a private event loop, like asyncio.run but
+        without replacing the caller's current event loop.  A caller that is
+        already inside a running loop gets the private loop on a worker thread.
+        """
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            try:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                loop.close()
+
+    if not _in_running_loop():
+        return run()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run).result()
+
+
 class _RemoteEnum(Enum):
 
     @staticmethod
@@ -64,16 +137,34 @@ class _RemoteEnum(Enum):
         return self.__qualname__.split('.')[0].replace('Remote', '') + "Variant"
 
 class Remote:
+    __slots__ = (
+        'error', 'soapy_dict', 'driver', 'firmware', 'fpga', 'label',
+        'remote_driver', 'remote', 'remote_type', 'revision', 'serial',
+        'address', '_bare_ip', '_json_url', 'username', 'password', '_json',
+        '_aioloop', '_ssh_lock', 'ssh_connection', 'ssh_session', 'variant',
+    )
+
+    # Shared by every remote so that fetches reuse pooled keep-alive connections.
+    _http_session = None
+    _http_session_loop = None
+    # (etag, last_modified, body) by url, for devices that answer conditional
+    # requests, so repeated discovery in one process skips unchanged bodies.
+    # The raw body is kept so every fetch parses its own copy of the json.
+    _json_cache = OrderedDict()
+    JSON_CACHE_SIZE = 256
+    # ssh connections keyed by (ip_address, username), reused across sshify
+    # on the event loop they were opened on.
+    _ssh_pool = {}
+    _ssh_pool_loop = None
+
     @classmethod
     def mac_to_uaa_id(cls, mac):
-        uaa_id = 0
-        for byte_idx in range(3):
-            uaa_id += ((mac >> (byte_idx*8))&0xff) << ((2-byte_idx)*8)
-        return uaa_id
+        # Byte reverse the low 24 bits, ie: 0x..abcdef -> 0xefcdab
+        return ((mac & 0xff) << 16) | (mac & 0xff00) | ((mac >> 16) & 0xff)
 
     @property
     def ip_address(self):
-        return self.address if "[" not in self.address else self.address[1:-1]
+        return self._bare_ip
 
     @asynccontextmanager
     async def _ssh_session_no_connection(self):
@@ -86,21 +177,42 @@ class Remote:
             yield None
         raise Exception("Connection not currently active?")
 
+    @staticmethod
+    def _ssh_connection_closed(connection):
+        is_closed = getattr(connection, "is_closed", None)
+        if is_closed is not None:
+            return is_closed()
+        return getattr(connection, "_transport", None) is None
+
     @asynccontextmanager
     async def ssh_connect(self):
         """
             Async context manager handling an ssh connection for a given device.
-            Consider using sshify instead.
+            Connections are kept in a pool shared by all remotes and stay open
+            after the context exits, callers must await Remote.close_pool on the
+            same loop once done with them.  Consider using sshify instead.
             """
+        if self._ssh_lock is None:
+            self._ssh_lock = asyncio.Lock()
         async with self._ssh_lock:
             try:
-                self.ssh_connection = await asyncssh.connect(
-                    self.address if "[" not in self.address else self.address[1:-1],
-                    username=self.username,
-                    password=self.password,
-                    known_hosts=None,
-                    client_keys=[],
-                )
+                loop = asyncio.get_event_loop()
+                if Remote._ssh_pool_loop is not loop:
+                    # Connections opened on another loop can't be used here.
+                    Remote._ssh_pool.clear()
+                    Remote._ssh_pool_loop = loop
+                key = (self.ip_address, self.username)
+                connection = Remote._ssh_pool.get(key)
+                if connection is None or Remote._ssh_connection_closed(connection):
+                    connection = await asyncssh.connect(
+                        self.ip_address,
+                        username=self.username,
+                        password=self.password,
+                        known_hosts=None,
+                        client_keys=[],
+                    )
+                    Remote._ssh_pool[key] = connection
+                self.ssh_connection = connection
 
                 @asynccontextmanager
                 async def _ssh_session_has_connection(self):
@@ -114,12 +226,31 @@ class Remote:
                 self.ssh_connection = None
                 self.ssh_session = MethodType(Remote._ssh_session_no_connection, self)
 
+    @classmethod
+    async def close_pool(cls):
+        """
+            Closes every pooled ssh connection.  Must be awaited on the loop
+            the connections were opened on.
+            """
+        connections = list(Remote._ssh_pool.values())
+        Remote._ssh_pool.clear()
+        Remote._ssh_pool_loop = None
+        for connection in connections:
+            if not Remote._ssh_connection_closed(connection):
+                connection.close()
+        for connection in connections:
+            try:
+                await connection.wait_closed()
+            except Exception as e:
+                log.debug(e)
+
     @staticmethod
     @asynccontextmanager
     async def sshify(remotes):
         """
             Async Context Manager where, for each remote in remotes, holding this
-            context will transparently hold an ssh context for the remote.
+            context will transparently hold an ssh context for the remote.  The
+            connections are pooled, await Remote.close_pool when finished.
             """
         async with AsyncExitStack() as stack:
             connections = await asyncio.gather(*[
@@ -127,28 +258,61 @@ class Remote:
             ])
             yield list(connections)
 
+    @classmethod
+    async def get_session(cls):
+        """
+            Returns the aiohttp session shared by all remotes, lazily creating
+            it for the running event loop.
+            """
+        loop = asyncio.get_event_loop()
+        if (Remote._http_session is None or Remote._http_session.closed or
+                Remote._http_session_loop is not loop):
+            Remote._http_session = aiohttp.ClientSession(
+                # Hold dns answers for the whole run rather than aiohttp's 10s.
+                connector=aiohttp.TCPConnector(
+                    limit=64, limit_per_host=4, keepalive_timeout=30, ttl_dns_cache=300),
+                # No overall limit here, Discover bounds each fetch with its
+                # fetch_timeout so that there is a single knob for it.
+                timeout=aiohttp.ClientTimeout(total=None))
+            Remote._http_session_loop = loop
+        return Remote._http_session
+
+    @classmethod
+    async def close_session(cls):
+        """
+            Closes the shared aiohttp session, must be awaited on the loop
+            that created it before that loop is closed.
+            """
+        session = Remote._http_session
+        Remote._http_session = None
+        Remote._http_session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
     def __init__(self, soapy_dict, loop=None):
         self.error = False
         self.soapy_dict = soapy_dict
-        self.driver = soapy_dict["driver"] if "driver" in soapy_dict else None
-        self.firmware = soapy_dict["firmware"] if "firmware" in soapy_dict else None
-        self.fpga = soapy_dict["fpga"] if "fpga" in soapy_dict else None
-        self.label = soapy_dict["label"] if "label" in soapy_dict else None
-        self.remote_driver = (
-            soapy_dict["remote:driver"] if "remote:driver" in soapy_dict else None)
-        self.remote = soapy_dict["remote"] if "remote" in soapy_dict else None
-        self.remote_type = (
-            soapy_dict["remote:type"] if "remote:type" in soapy_dict else None)
-        self.revision = soapy_dict["revision"] if "revision" in soapy_dict else None
-        self.serial = soapy_dict["serial"] if "serial" in soapy_dict else None
+        self.driver = soapy_dict.get("driver")
+        self.firmware = soapy_dict.get("firmware")
+        self.fpga = soapy_dict.get("fpga")
+        self.label = soapy_dict.get("label")
+        self.remote_driver = soapy_dict.get("remote:driver")
+        self.remote = soapy_dict.get("remote")
+        self.remote_type = soapy_dict.get("remote:type")
+        self.revision = soapy_dict.get("revision")
+        self.serial = soapy_dict.get("serial")
         self.address = None  # default no known url
+        self._bare_ip = None  # address without the IPv6 braces
         self._json_url = None  # default no known url
         self.username = None
         self.password = None
         self._json = None  # default no json
-        self._aioloop = loop if loop is not None else asyncio.get_event_loop()
-        # ensure only one connection exists at a time.
-        self._ssh_lock = asyncio.Lock(loop=self._aioloop)
+        # Only kept when given, discovery runs on a private loop that is
+        # closed before the remotes are used.
+        self._aioloop = loop
+        # ensure only one connection exists at a time, created on first use
+        # so that it belongs to the loop the connection is made on.
+        self._ssh_lock = None
         self.ssh_connection = None
         self.ssh_session = MethodType(Remote._ssh_session_no_connection, self)
 
@@ -159,18 +323,36 @@ class Remote:
         self.username = username
         self.password = password
 
-    @asyncio.coroutine
     async def afetch(self):
         """
             Asynchronous method to fetch additional information from the device.
             """
         if self._json_url is not None:
             log.debug("coro remote called not none")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self._json_url) as response:
-                    self._json = await response.json()
-                    logging.debug("json successfully set for url {}".format(
-                        self._json_url))
+            session = await Remote.get_session()
+            cached = Remote._json_cache.get(self._json_url)
+            headers = {}
+            if cached is not None:
+                if cached[0]:
+                    headers["If-None-Match"] = cached[0]
+                if cached[1]:
+                    headers["If-Modified-Since"] = cached[1]
+            async with session.get(self._json_url, headers=headers) as response:
+                if response.status == 304 and cached is not None:
+                    self._json = _json_loads(cached[2])
+                    Remote._json_cache.move_to_end(self._json_url)
+                else:
+                    response.raise_for_status()
+                    body = await response.read()
+                    self._json = _json_loads(body)
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if etag or last_modified:
+                        Remote._json_cache[self._json_url] = (etag, last_modified, body)
+                        Remote._json_cache.move_to_end(self._json_url)
+                        if len(Remote._json_cache) > Remote.JSON_CACHE_SIZE:
+                            Remote._json_cache.popitem(last=False)
+                log.debug("json successfully set for url %s", self._json_url)
         else:
             log.debug("url was none")
         return self
@@ -203,12 +385,25 @@ class Remote:
     def __iter__(self):
         raise NotImplementedError
 
+    @staticmethod
+    def _walk_json(root, path):
+        """
+            Follows path through nested dicts, returning None if any key along
+            the way is missing or lands on something other than a dict, eg: a
+            status reporting "sfp": "None".
+            """
+        current = root
+        for key in path:
+            if not isinstance(current, dict):
+                return None
+            current = current.get(key)
+        return current
+
     def _try_get_json(self, *fields):
+        json_status = self._json
         for field in fields:
-            try:
-                return self._json[field]
-            except KeyError:
-                continue
+            if field in json_status:
+                return json_status[field]
 
         raise KeyError('Fields {} do not exist in the JSON'.format(fields))
 
@@ -221,6 +416,7 @@ class Remote:
         yield self
 
 class CPERemote(Remote):
+    __slots__ = ('rrh_head', 'last_mac', 'uaa_id')
     NAME = "CPE"
 
     class Variant(_RemoteEnum):
@@ -232,11 +428,7 @@ class CPERemote(Remote):
         # About us, set by us
         self.last_mac = None
         self.uaa_id = None
-        url = urllib.parse.urlparse(self.remote)
-        self.address = url.hostname
-        if not is_ipv4(self.address):
-            self.address = "[" + self.address + "]"
-        self._json_url = url._replace(scheme="http", netloc=self.address).geturl()
+        self.address, self._bare_ip, self._json_url = _parse_remote_url(self.remote)
         self.variant = (
             CPERemote.Variant.STANDARD)
         # After e2400b4a9647f633086d1088b61460c03e79f616 is merged into sklk-dev, we can check device type.
@@ -246,18 +438,12 @@ class CPERemote(Remote):
         yield self
         return
 
-    @asyncio.coroutine
     async def afetch(self):
         try:
             await super().afetch()
             self.last_mac = int(self._json["extra"]["gateway_addr"], 16)
             self.uaa_id = self.mac_to_uaa_id(self.last_mac)
-            self.rrh_head = (
-                reduce(
-                    lambda x, y: x[y] if x is not None and y in x else None,
-                    ["sfp", "config", "rrh", "serial"],
-                    self._json,
-                ) is not None)
+            self.rrh_head = self._walk_json(self._json, _RRH_SERIAL_PATH) is not None
             return self
         except Exception as e:
             log.debug(e)
@@ -268,6 +454,7 @@ class CPERemote(Remote):
                                                    self.firmware, self.fpga)
 
 class VgerRemote(Remote):
+    __slots__ = ('rrh_head', 'last_mac', 'uaa_id')
     NAME = "VGER"
 
     class Variant(_RemoteEnum):
@@ -279,11 +466,7 @@ class VgerRemote(Remote):
         # About us, set by us
         self.last_mac = None
         self.uaa_id = None
-        url = urllib.parse.urlparse(self.remote)
-        self.address = url.hostname
-        if not is_ipv4(self.address):
-            self.address = "[" + self.address + "]"
-        self._json_url = url._replace(scheme="http", netloc=self.address).geturl()
+        self.address, self._bare_ip, self._json_url = _parse_remote_url(self.remote)
         self.variant = VgerRemote.Variant.VGER
         # After e2400b4a9647f633086d1088b61460c03e79f616 is merged into sklk-dev, we can check device type.
         # https://gitlab.com/skylark-wireless/software/sklk-dev/-/merge_requests/94
@@ -292,18 +475,12 @@ class VgerRemote(Remote):
         yield self
         return
 
-    @asyncio.coroutine
     async def afetch(self):
         try:
             await super().afetch()
             self.last_mac = int(self._json["extra"]["gateway_addr"], 16)
             self.uaa_id = self.mac_to_uaa_id(self.last_mac)
-            self.rrh_head = (
-                reduce(
-                    lambda x, y: x[y] if x is not None and y in x else None,
-                    ["sfp", "config", "rrh", "serial"],
-                    self._json,
-                ) is not None)
+            self.rrh_head = self._walk_json(self._json, _RRH_SERIAL_PATH) is not None
             return self
         except Exception as e:
             log.debug(e)
@@ -314,6 +491,11 @@ class VgerRemote(Remote):
                                                      self.fpga)
 
 class IrisRemote(Remote):
+    __slots__ = (
+        'sfp_serial', 'sfp_version', 'fe_serial', 'fe_version', 'frontend',
+        'last_mac', 'uaa_id', 'rrh_head', 'rrh_index', 'rrh', 'chain_index',
+        'hub', 'rrh_member', 'chain',
+    )
 
     class Variant(_RemoteEnum):
         RRH = "iris030_rrh"
@@ -335,11 +517,7 @@ class IrisRemote(Remote):
         # About us, set by us
         self.last_mac = None
         self.uaa_id = None
-        url = urllib.parse.urlparse(self.remote)
-        self.address = url.hostname
-        if not is_ipv4(self.address):
-            self.address = "[" + self.address + "]"
-        self._json_url = url._replace(scheme="http", netloc=self.address).geturl()
+        self.address, self._bare_ip, self._json_url = _parse_remote_url(self.remote)
         self.rrh_head = None
         self.rrh_index = None
         self.rrh = None
@@ -356,7 +534,6 @@ class IrisRemote(Remote):
         yield self
         return
 
-    @asyncio.coroutine
     async def afetch(self):
         try:
             await super().afetch()
@@ -364,29 +541,23 @@ class IrisRemote(Remote):
             self.uaa_id = self.mac_to_uaa_id(self.last_mac)
             self.rrh_index = int(self._json["global"]["message_index"]) - 1
             self.chain_index = int(self._json["global"]["chain_index"])
-            self.rrh_head = (
-                reduce(
-                    lambda x, y: x[y] if x is not None and y in x else None,
-                    ["sfp", "config", "rrh", "serial"],
-                    self._json,
-                ) is not None)
+            self.rrh_head = self._walk_json(self._json, _RRH_SERIAL_PATH) is not None
             return self
         except Exception as e:
             log.debug(e)
             return None
 
-    def _map_to_hub(self, hubs):
+    def _map_to_hub(self, mac_to_hubs):
         """
-            Called in Discover constructor with all discovered hubs, so that a
-            bidirectional mapping can occur, hopefully independently and without
-            error.
+            Called in Discover constructor with all discovered hubs indexed by
+            their macmatches, so that a bidirectional mapping can occur,
+            hopefully independently and without error.
             """
-        for hub in hubs:
-            if self.last_mac in hub.macmatches:
-                if self.hub is not None:
-                    raise AssertionError("Remapping iris from {} to {}".format(
-                        self.hub, hub))
-                self.hub = hub
+        for hub in mac_to_hubs.get(self.last_mac, ()):
+            if self.hub is not None:
+                raise AssertionError("Remapping iris from {} to {}".format(
+                    self.hub, hub))
+            self.hub = hub
         if self.rrh_member is None:
             self.rrh_member = False
 
@@ -407,6 +578,10 @@ class NotAnRRH(Exception):
 
 
 class RRH:
+    __slots__ = (
+        'nodes', 'head', 'error', 'address', 'hub', 'config', 'serial', 'tail',
+        'chain', 'config_correct',
+    )
 
     def __delitem__(self, key):
         raise NotImplementedError
@@ -453,29 +628,19 @@ class RRH:
         self.nodes = list(sorted(members, key=lambda x: x.rrh_index))
         self.serial = self.config["serial"]
         self.tail = self.nodes[-1]
-        self.chain = getattr(
-            reduce(
-                lambda x, y: y
-                if x is not None and x.chain_index == y.chain_index else None,
-                self.nodes,
-            ),
-            "chain_index",
-            None,
-        )
+        first_chain = self.nodes[0].chain_index
+        self.chain = (
+            first_chain
+            if all(node.chain_index == first_chain for node in self.nodes) else None)
         assert (
             self.chain is not None
         ), "Disagreement amongst RRH {} about what chain we're on. {}".format(
             self.serial, [x.chain_index for x in self.nodes])
         # Constructs pairs of node serial / config serials, check for equality,
         # then ensure that you have Trues all the way down.
-        self.config_correct = reduce(
-            lambda x, y: x and y,
-            map(
-                lambda x: x[0] == x[1],
-                zip(map(lambda x: x.serial, self.nodes), self.config["chain"]),
-            ),
-            True,
-        )
+        self.config_correct = all(
+            node.serial == config_serial
+            for node, config_serial in zip(self.nodes, self.config["chain"]))
         # REVISIT: To really be useful, this message needs to only occur when the nodes don't match.
         # It should not happen when nodes are missing since that is more obvious and somewhat common.
         if not self.config_correct:
@@ -487,7 +652,11 @@ class RRH:
             iris.chain = self.chain
 
     def __iter__(self):
-        return iter(list(sorted(self.nodes, key=lambda x: x.rrh_index)))
+        # Already sorted by rrh_index in the constructor.
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
 
     def __str__(self):
         return self.serial
@@ -518,14 +687,17 @@ class Chain(OrderedDict):
         for device in self.values():
             yield device
 
-    def async_do_reboot(self, recursive, force=False):
-        for device in self.values():
-            device.async_do_reboot()
+    async def async_do_reboot(self, recursive, force=False):
+        await asyncio.gather(*[device.async_do_reboot() for device in self.values()])
 
     def set_credentials(self, username, password):
         pass
 
 class HubRemote(Remote):
+    __slots__ = (
+        'cpld', 'macmatches', 'chains', '_sorted_chain_items', '_flat', '_irises',
+        '_irises_by_serial', '_unpaired_nodes',
+    )
     LAST_POSSIBLE_CHAIN = 7
     REFERENCE_NODE_CHAIN = [6, ]
 
@@ -565,26 +737,21 @@ class HubRemote(Remote):
     def __init__(self, soapy_dict, loop=None):
         super().__init__(soapy_dict, loop=loop)
         self.error = False
-        self.cpld = soapy_dict["cpld"] if "cpld" in soapy_dict else None
-        url = urllib.parse.urlparse(self.remote)
-        self.address = url.hostname
-        # Annoying hack, aiohttp requires braces on URLs, asyncssh requires
-        # they not be present, and urllib has no facilities for injecting and
-        # removing them.
-        if not is_ipv4(self.address):
-            self.address = "[" + self.address + "]"
-        self._json_url = url._replace(
-            scheme="http", path="/status.json", netloc=self.address).geturl()
+        self.cpld = soapy_dict.get("cpld")
+        self.address, self._bare_ip, self._json_url = _parse_remote_url(
+            self.remote, "/status.json")
         # represents, as a signed integer, the last 6 nibbles of the mac
         # address, grouped as pairs, reversed as pairs.
         # If you don't get it, just don't worry about it.
         # ie: ab:cd:ef -> 0xefcdab
-        self.macmatches = []
+        self.macmatches = frozenset()
         self.variant = {
             "zu6eg": HubRemote.Variant.SOM6,
             "zu9eg": HubRemote.Variant.SOM9,
         }.get(soapy_dict.get("som", None), HubRemote.Variant.HUB)
         self.chains = OrderedDict()
+        self._sorted_chain_items = ()
+        self._flat = (self, )
 
     def _detect_som_version(self):
         connection = EasySsh(self.serial, self.address, self.username, self.password)
@@ -605,27 +772,34 @@ class HubRemote(Remote):
             log.debug("{}: setting hub variant to {}".format(self.serial, self.variant))
 
     def _update_irises(self):
+        """
+            Asks the hub to have its irises refresh their status.  Blocks on
+            SoapySDR, Discover runs it for every hub in worker threads and then
+            fetches the refreshed status for all hubs in a single gather.
+            """
         hub = SoapySDR.Device(self.soapy_dict)
         hub.writeRegister("FAROS_TOP", 0xa0, (0xff << 24))
-        asyncio.get_event_loop().run_until_complete(asyncio.gather(*[iris.afetch() for iris in self._irises]))
+
+    def _connected_irises(self, irises):
+        macmatches = self.macmatches
+        return [iris for iris in irises if iris.last_mac in macmatches]
 
     def _map_irises(self, irises):
         """
             Given all possible irises, figure out which ones are connected directly
-            to this hub.
+            to this hub.  The irises are expected to already be fetched.  Discover
+            passes only the irises whose mac matched this hub, irises on one daisy
+            chain share the same mac so they can't be indexed by it.
             """
-        self._irises = list(
-            filter(lambda x: x.last_mac in self.macmatches, irises))
-        self._update_irises()
+        self._irises = self._connected_irises(irises)
 
-        self._irises_by_serial = dict((iris.serial, iris) for iris in self._irises)
+        self._irises_by_serial = {iris.serial: iris for iris in self._irises}
         self._unpaired_nodes = {}
-        for chain in sorted(list({x.chain_index for x in self._irises})):
-            this_chain = list(
-                sorted(
-                    filter(lambda x: x.chain_index == chain, self._irises),
-                    key=lambda x: x.rrh_index,
-                ))
+        by_chain = {}
+        for iris in self._irises:
+            by_chain.setdefault(iris.chain_index, []).append(iris)
+        for chain in sorted(by_chain.keys()):
+            this_chain = sorted(by_chain[chain], key=lambda x: x.rrh_index)
             rrhs, error = self.filter_chain_for_bad_indexes(chain, this_chain)
             if error:
                 self.error = True
@@ -640,6 +814,21 @@ class HubRemote(Remote):
             self.create_chain(chain_idx, nodes, True)
             chain_idx += 1
 
+        # The displays walk the chains in index order, sort them once here and
+        # give every index a tuple of chains so they don't have to check.
+        self._sorted_chain_items = tuple(
+            (k, tuple(self.chains[k]) if isinstance(self.chains[k], list) else (self.chains[k], ))
+            for k in sorted(self.chains.keys()))
+        # And flatten the hub and everything under it for iteration.
+        flat = [self]
+        for chain in self._iter_chains():
+            if isinstance(chain, RRH):
+                flat.append(chain)
+                flat.extend(chain)
+            else:
+                flat.extend(chain.values())
+        self._flat = tuple(flat)
+
     def create_chain(self, chain_idx, nodes, error):
         if (not nodes):
             return
@@ -653,7 +842,8 @@ class HubRemote(Remote):
                 error = True
         if chain is None:
             chain = Chain()
-            for iris in nodes:
+            # Inserted in index order so the displays can walk it as is.
+            for iris in sorted(nodes, key=lambda x: x.rrh_index):
                 chain[iris.rrh_index] = iris
                 iris.chain = nodes
             chain.error = error
@@ -688,14 +878,14 @@ class HubRemote(Remote):
         heads = RRH.get_heads(this_chain)
         rrhs = []
         for head in heads:
-            nodes = []
-            for serial in RRH.get_config_from_head(head).get("chain", []):
-                new_chain = []
-                for node in this_chain:
-                    if node.rrh_index < 0:
-                        error = True
-                    (nodes if node.serial == serial else new_chain ).append(node)
-                this_chain = new_chain
+            config_chain = RRH.get_config_from_head(head).get("chain", [])
+            if config_chain and any(node.rrh_index < 0 for node in this_chain):
+                error = True
+            # Pull the head's configured nodes out in config order, the rest
+            # stay behind in rrh_index order for the next head.
+            by_serial = OrderedDict((node.serial, node) for node in this_chain)
+            nodes = [by_serial.pop(serial) for serial in config_chain if serial in by_serial]
+            this_chain = list(by_serial.values())
             rrhs.append(nodes)
 
         if this_chain:
@@ -703,59 +893,55 @@ class HubRemote(Remote):
 
         return rrhs, error
 
-    @asyncio.coroutine
     async def afetch(self):
         try:
             await super().afetch()
-            # Get last-3's of macaddress
-            self.macmatches = [
-                int("".join(reversed(k[3::])), 16)
-                for k in map(lambda x: x.split(":"), self._try_get_json('jtagblob', 'config')
-                             ["network"].values())
-            ]
+            # Get last-3's of macaddress, byte reversed
+            self.macmatches = frozenset(
+                int.from_bytes(bytes.fromhex(mac.replace(":", "")[-6:]), "little")
+                for mac in self._try_get_json('jtagblob', 'config')["network"].values()
+            )
             return self
         except Exception as e:
             log.debug(e)
             return None
 
+    def _iter_chains(self):
+        """
+            Yields every chain on the hub, flattening chain indexes that hold
+            more than one chain.
+            """
+        for rrhs in self.chains.values():
+            if isinstance(rrhs, list):
+                yield from rrhs
+            else:
+                yield rrhs
+
     def __iter__(self):
-        try:
-            yield self
-            for rrhs in self.chains.values():
-                if type(rrhs) is not list:
-                    rrhs = [rrhs, ]
-                for chain in rrhs:
-                    if isinstance(chain, RRH):
-                        yield chain
-                        for v in chain:
-                            yield v
-                    else:
-                        for c in chain.values():
-                            yield c
-        except StopIteration:
-            return
+        # Built by _map_irises, the chains don't change after that.
+        return iter(self._flat)
 
     def walk(self, depth=None):
         if depth != 0:
             depth = depth-1 if depth is not None else None
-            for rrhs in self.chains.values():
-                if type(rrhs) is not list:
-                    rrhs = [rrhs, ]
-                for chain in rrhs:
-                    yield from chain.walk(depth)
+            for chain in self._iter_chains():
+                yield from chain.walk(depth)
         yield self
 
     async def async_do_reboot(self, recursive=False, force=False):
         async with Remote.sshify([self, ]):
             from pyfaros.updater.updater import do_reboot
             if force:
+                # Sessions share the one ssh connection, so the chains reboot concurrently.
+                tasks = []
                 for chain_idx in range(self.LAST_POSSIBLE_CHAIN):
                     if chain_idx in self.REFERENCE_NODE_CHAIN:
                         device = self.chains[chain_idx]
-                        await device.async_do_reboot(recursive, force)
+                        tasks.append(device.async_do_reboot(recursive, force))
                     else:
                         cmd = "sudo -n chain_power reboot {}".format(chain_idx+1)
-                        await self.ssh_connection.run(cmd, check=True, term_type='xterm')
+                        tasks.append(self.ssh_connection.run(cmd, check=True, term_type='xterm'))
+                await asyncio.gather(*tasks)
             else:
                 for device in self.walk(depth=1 if recursive else 0):
                     if device != self:
@@ -764,140 +950,110 @@ class HubRemote(Remote):
             print("Rebooting {}".format(self.serial))
             await do_reboot(self)
 
+class _TextTree:
+    """
+        Minimal stand-in for treelib.Tree covering what Discover._as_tree uses.
+        Renders the same text as treelib, siblings sorted by tag, without
+        treelib's per-node bookkeeping.
+        """
+    __slots__ = ('_root', '_tags', '_children')
+
+    def __init__(self):
+        self._root = None
+        self._tags = {}
+        self._children = {}
+
+    def create_node(self, tag, identifier=None, parent=None):
+        if identifier is None:
+            identifier = object()
+        self._tags[identifier] = tag
+        self._children[identifier] = []
+        if parent is None:
+            self._root = identifier
+        else:
+            self._children[parent].append(identifier)
+
+    def _render(self, identifier, lead, lines):
+        children = sorted(self._children[identifier], key=self._tags.__getitem__)
+        last = len(children) - 1
+        for idx, child in enumerate(children):
+            lines.append(lead + ("└── " if idx == last else "├── ") + self._tags[child])
+            self._render(child, lead + ("    " if idx == last else "│   "), lines)
+
+    def __str__(self):
+        if self._root is None:
+            return ""
+        lines = [self._tags[self._root]]
+        self._render(self._root, "", lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
 class Discover:
     """
       Performs a network scan (by way of SoapySDR.Device.enumerate()) on
       instantiation, queries devices for additional information, and organizes
       results such that one can query for devices on a hub channel, by chain
       order, etc. Warning: in case you missed that, this constructor will block
-      on IO.
+      on IO.  From a coroutine, await Discover.create instead.
       """
 
-    def __init__(self, soapy_enumerate_iterations=3, output=None, timeout_ms=800, ipv6=False, json_filename=None):
+    # Seconds between starting each enumerate scan, the same spacing the avahi
+    # retries used to have, so that the queries go out separately rather
+    # than being answered as one within a single scan window.
+    SCAN_STAGGER = 1.0
+
+    def __init__(self, soapy_enumerate_iterations=3, output=None, timeout_ms=800, ipv6=False, json_filename=None,
+                 fetch_concurrency=32, fetch_timeout=5.0, progress=None):
+        self._setup(soapy_enumerate_iterations, output, timeout_ms, ipv6, json_filename,
+                    fetch_concurrency, fetch_timeout, progress)
+        # Get all of the json additional information at once.
+        self._all = _run_coroutine(self._discover_async(self._enumerate_args, self._enumerate_iterations))
+        self._build_topology()
+
+    @classmethod
+    async def create(cls, soapy_enumerate_iterations=3, output=None, timeout_ms=800, ipv6=False,
+                     json_filename=None, fetch_concurrency=32, fetch_timeout=5.0, progress=None):
+        """
+            Awaitable equivalent of Discover(...), running the discovery on the
+            caller's event loop rather than blocking it.  progress is called on
+            that loop's thread.
+            """
+        self = cls.__new__(cls)
+        self._setup(soapy_enumerate_iterations, output, timeout_ms, ipv6, json_filename,
+                    fetch_concurrency, fetch_timeout, progress)
+        self._all = await self._discover_async(self._enumerate_args, self._enumerate_iterations)
+        self._build_topology()
+        return self
+
+    def _setup(self, soapy_enumerate_iterations, output, timeout_ms, ipv6, json_filename,
+               fetch_concurrency, fetch_timeout, progress):
         self.time = datetime.datetime.now()
-        # Grab an event loop so that we can get all of the json additional
-        # information at once.
-        self._loop = asyncio.new_event_loop()
+        # Called with each remote as its first fetch finishes, successful or not,
+        # so that callers can report on discovery while it is still running.
+        self._progress = progress
+        # Bound the fetches in flight and the time any one device may take.
+        self._fetch_concurrency = fetch_concurrency
+        self._fetch_timeout = fetch_timeout
+        self._fetch_semaphore = None
         self._yaml = False
         self._json_out = False
         self._json_filename = json_filename
         # Avahi broadcasts occasionally don't respond in time. Do it with a
         # long timeout, and do it a lot, to try to get a good picture.
-        soapy_enumerations = {}
-        for _ in range(0, soapy_enumerate_iterations):
-            args = SoapySDR.SoapySDRKwargs()
-            args['remote:timeout'] = str(timeout_ms * 1000)
+        args = SoapySDR.SoapySDRKwargs()
+        args['remote:timeout'] = str(timeout_ms * 1000)
 
-            if ipv6:
-                args['remote:ipver'] = '6'
+        if ipv6:
+            args['remote:ipver'] = '6'
 
-            for found in map(dict, SoapySDR.Device.enumerate(args)):
-                if "serial" in found and found["serial"] not in soapy_enumerations:
-                    soapy_enumerations[found["serial"]] = found
-            time.sleep(1)
-        self._soapy_enumerate = list(soapy_enumerations.values())
+        self._enumerate_args = args
+        self._enumerate_iterations = soapy_enumerate_iterations
 
-        # Filter for hubs and irises
-        # FIXME: Hacks here until all cpes have a sane fpga string.
-        self._irises = list(
-            map(
-                partial(IrisRemote, loop=self._loop),
-                filter(
-                    lambda x: "remote:type" in
-                    x.keys() and "iris" in x["remote:type"] and "serial" in x.keys()
-                    and "CP" not in x["serial"],
-                    self._soapy_enumerate,
-                ),
-            ))
-
-        # FIXME: change this when fpga strings are sane
-        self._cpes = list(
-            map(
-                partial(CPERemote, loop=self._loop),
-                filter(
-                    lambda x: "remote:type" in x.keys() and "cpe" in x["remote:type"] and
-                     "serial" in x.keys() and "CP" in x["serial"],
-                    self._soapy_enumerate,
-                ),
-            ))
-
-        # FIXME: confirm correct strings for this
-        self._vgers = list(
-            map(
-                partial(VgerRemote, loop=self._loop),
-                filter(
-                    lambda x: "remote:type" in x.keys() and "cpe" in x["remote:type"] and
-                     "serial" in x.keys() and "VG" in x["serial"],
-                    self._soapy_enumerate,
-                ),
-            ))
-
-        self._hubs = list(
-            map(
-                partial(HubRemote, loop=self._loop),
-                filter(
-                    lambda x: "remote:type" in x.keys() and "faros" in x[
-                        "remote:type"],
-                    self._soapy_enumerate,
-                ),
-            ))
-        # Stage up the fetches
-        iris_fetch_tasks = asyncio.gather(
-            *map(
-                lambda x: asyncio.ensure_future(x.afetch(), loop=self._loop),
-                self._irises,
-            ),
-            loop=self._loop)
-        cpe_fetch_tasks = asyncio.gather(
-            *map(
-                lambda x: asyncio.ensure_future(x.afetch(), loop=self._loop),
-                self._cpes,
-            ),
-            loop=self._loop)
-        vger_fetch_tasks = asyncio.gather(
-            *map(
-                lambda x: asyncio.ensure_future(x.afetch(), loop=self._loop),
-                self._vgers,
-            ),
-            loop=self._loop)
-        hub_fetch_tasks = asyncio.gather(
-            *map(
-                lambda x: asyncio.ensure_future(x.afetch(), loop=self._loop),
-                self._hubs,
-            ),
-            loop=self._loop)
-        # Go, go, go!
-        fetchall = asyncio.ensure_future(
-            asyncio.gather(
-                iris_fetch_tasks, hub_fetch_tasks, cpe_fetch_tasks, vger_fetch_tasks,
-                loop=self._loop),
-            loop=self._loop,
-        )
-        self._all = self._loop.run_until_complete(fetchall)
-        self._loop.close()
-        # Doing this bidirectionally so that neither class modifies the other,
-        # it can be more efficient than this, but looping over each provides
-        # the opportunity to catch inconsistencies and detect strange
-        # scenarios.
-        for hub in self._hubs:
-            hub._map_irises(self._irises)
-        for iris in self._irises:
-            iris._map_to_hub(self._hubs)
-        self._rrhs = list(
-            filter(
-                Discover.Filters.RRH,
-                reduce(
-                    lambda x, y: x + y,
-                    [list(hub.chains.values()) for hub in self._hubs],
-                    [],
-                ),
-            ))
-        self._standalone_irises = list(
-            filter(Discover.Filters.IRIS_STANDALONE, self._irises))
-        self._partial_chain_irises = list(
-            filter(Discover.Filters.IRIS_PARTIALCHAIN, self._irises))
-        self._rrh_member_irises = list(
-            filter(Discover.Filters.IRIS_RRHMEMBER, self._irises))
+        self._irises = []
+        self._cpes = []
+        self._vgers = []
+        self._hubs = []
 
         # Display options
         if output:
@@ -905,6 +1061,151 @@ class Discover:
         else:
             self.single_field = ""
         self.delim = " "
+        # The text renderer matches treelib's output, treelib is kept for callers that want it.
+        self._use_treelib = False
+
+    def _build_topology(self):
+        # Doing this bidirectionally so that neither class modifies the other,
+        # which provides the opportunity to catch inconsistencies and detect
+        # strange scenarios.  Indexing the hubs by mac lets each side be
+        # handed only the devices that can match, in a single pass.
+        mac_to_hubs = {}
+        for hub in self._hubs:
+            for mac in hub.macmatches:
+                mac_to_hubs.setdefault(mac, []).append(hub)
+        hub_irises = {hub: [] for hub in self._hubs}
+        for iris in self._irises:
+            for hub in mac_to_hubs.get(iris.last_mac, ()):
+                hub_irises[hub].append(iris)
+        for hub in self._hubs:
+            hub._map_irises(hub_irises[hub])
+        for iris in self._irises:
+            iris._map_to_hub(mac_to_hubs)
+        self._rrhs = [
+            chain for hub in self._hubs for chain in hub.chains.values()
+            if Discover.Filters.RRH(chain)
+        ]
+        # Same split as the Filters.IRIS_* predicates, done in one pass.
+        self._standalone_irises = []
+        self._partial_chain_irises = []
+        self._rrh_member_irises = []
+        for iris in self._irises:
+            if iris.rrh_member is False:
+                if iris.hub is None:
+                    self._standalone_irises.append(iris)
+                else:
+                    self._partial_chain_irises.append(iris)
+            elif iris.rrh_member is True and iris.hub is not None:
+                self._rrh_member_irises.append(iris)
+        # Everything not attached to a hub, in display order.
+        self._clients = self._standalone_irises + self._cpes + self._vgers
+        # The topology is fixed from here on, flatten it once for iteration.
+        self._devices = tuple(
+            itertools.chain(itertools.chain.from_iterable(self._hubs), self._clients))
+
+    def _add_remotes(self, found):
+        """
+            Creates the remotes for a newly enumerated device, returning them
+            so their fetches can be started right away.
+            """
+        remotes = []
+        remote_type = found.get("remote:type", "")
+        serial = found["serial"]
+        # FIXME: Hacks here until all cpes have a sane fpga string.
+        if "iris" in remote_type and "CP" not in serial:
+            self._irises.append(IrisRemote(found))
+            remotes.append(self._irises[-1])
+        if "cpe" in remote_type:
+            # FIXME: change this when fpga strings are sane
+            if "CP" in serial:
+                self._cpes.append(CPERemote(found))
+                remotes.append(self._cpes[-1])
+            # FIXME: confirm correct strings for this
+            if "VG" in serial:
+                self._vgers.append(VgerRemote(found))
+                remotes.append(self._vgers[-1])
+        if "faros" in remote_type:
+            self._hubs.append(HubRemote(found))
+            remotes.append(self._hubs[-1])
+        return remotes
+
+    async def _bounded_afetch(self, remote):
+        async with self._fetch_semaphore:
+            return await asyncio.wait_for(remote.afetch(), self._fetch_timeout)
+
+    async def _fetch_and_report(self, remote):
+        try:
+            return await self._bounded_afetch(remote)
+        finally:
+            if self._progress is not None:
+                self._progress(remote)
+
+    async def _enumerate_and_fetch(self, args, iterations):
+        """
+            Runs the soapy enumerations side by side in worker threads, starting
+            the json fetch for each device as soon as any scan reports it rather
+            than waiting for every scan to time out.
+            """
+        loop = asyncio.get_event_loop()
+        soapy_enumerations = {}
+        fetches = []
+        with ThreadPoolExecutor(max_workers=max(iterations, 1)) as pool:
+
+            async def scan_after(delay):
+                await asyncio.sleep(delay)
+                return await loop.run_in_executor(pool, SoapySDR.Device.enumerate, args)
+
+            scans = [
+                loop.create_task(scan_after(i * self.SCAN_STAGGER)) for i in range(0, iterations)
+            ]
+            try:
+                for scan in asyncio.as_completed(scans):
+                    for found in map(dict, await scan):
+                        serial = found.get("serial")
+                        if serial is not None and serial not in soapy_enumerations:
+                            soapy_enumerations[serial] = found
+                            fetches.extend(
+                                loop.create_task(self._fetch_and_report(remote))
+                                for remote in self._add_remotes(found))
+            except BaseException:
+                # Don't leave work pending on a loop that is about to close.
+                pending = scans + fetches
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise
+        self._soapy_enumerate = list(soapy_enumerations.values())
+        return await asyncio.gather(*fetches, return_exceptions=True)
+
+    async def _discover_async(self, args, iterations):
+        """
+            Enumerates and fetches every device, then refetches the irises
+            attached to hubs, all in one pass over the event loop.
+            """
+        # Created here so that it belongs to the running loop.
+        self._fetch_semaphore = asyncio.Semaphore(self._fetch_concurrency)
+        try:
+            # A device that fails or times out is left without json rather than
+            # failing the whole discovery.
+            fetched = [
+                result for result in await self._enumerate_and_fetch(args, iterations)
+                if not isinstance(result, Exception)
+            ]
+            # Have each hub refresh its irises, then fetch all of them at once.
+            # The register writes block in SoapySDR so they run off the loop.
+            if self._hubs:
+                loop = asyncio.get_event_loop()
+                with ThreadPoolExecutor(max_workers=len(self._hubs)) as pool:
+                    await asyncio.gather(*[
+                        loop.run_in_executor(pool, hub._update_irises) for hub in self._hubs])
+            hub_macs = frozenset().union(*(hub.macmatches for hub in self._hubs))
+            hub_irises = [iris for iris in self._irises if iris.last_mac in hub_macs]
+            await asyncio.gather(
+                *[self._bounded_afetch(iris) for iris in hub_irises], return_exceptions=True)
+            return fetched
+        finally:
+            # The shared session is bound to this loop, which is about to close.
+            await Remote.close_session()
 
     def set_options(self, yaml=None, json_out=None):
         if yaml is not None:
@@ -913,15 +1214,29 @@ class Discover:
             self._json_out = json_out
 
     def get_common(self, irises, field):
-        values = set([getattr(iris, field, None) for iris in irises])
-        if len(values) == 0:
-            return "no device"
-        if len(values) == 1:
-            if None in values:
-                return "unknown"
-            return ' '.join(values)
-        else:
-            return "mismatch"
+        return self.get_commons(irises, (field, ))[0]
+
+    def get_commons(self, irises, fields):
+        """
+            get_common for each of fields, in one pass over irises.  Stops
+            early once every field has a mismatch.
+            """
+        irises = iter(irises)
+        try:
+            first = next(irises)
+        except StopIteration:
+            return tuple("no device" for _ in fields)
+        values = [getattr(first, field, None) for field in fields]
+        matching = [True] * len(fields)
+        for iris in irises:
+            for idx, field in enumerate(fields):
+                if matching[idx] and getattr(iris, field, None) != values[idx]:
+                    matching[idx] = False
+            if not any(matching):
+                break
+        return tuple(
+            ("unknown" if value is None else value) if match else "mismatch"
+            for value, match in zip(values, matching))
 
     def _display_stand_alone(self, t, parent, idx_gen, nodes):
         if not nodes:
@@ -932,20 +1247,17 @@ class Discover:
             "{} Count: {}  FW {} FPGA {}".format(
                 name,
                 len(nodes),
-                self.get_common(nodes, 'firmware'),
-                self.get_common(nodes, 'fpga')),
+                *self.get_commons(nodes, ('firmware', 'fpga'))),
             standalone,
             parent=parent)
 
         if self.single_field:
-            node_list = self.delim.join(
-                str(getattr(iris, self.single_field))
-                for iris in nodes)
+            node_list = self.delim.join(map(str, map(attrgetter(self.single_field), nodes)))
             t.create_node(node_list, parent=standalone)
         else:
+            label = (name + " {}").format
             for node in nodes:
-                t.create_node(
-                    "{} {}".format(name, str(node)), idx_gen(), parent=standalone)
+                t.create_node(label(node), idx_gen(), parent=standalone)
 
     def __str__(self):
         if self._yaml:
@@ -956,18 +1268,16 @@ class Discover:
             return self._as_tree()
 
     def _as_tree(self):
-        def ctr():
-            val = [0]
-
-            def inc():
-                val[0] += 1
-                return val[0]
-
-            return inc
-
-        c = ctr()
-        from treelib import Tree
-        t = Tree()
+        c = itertools.count(1).__next__
+        if self._use_treelib:
+            from treelib import Tree
+            t = Tree()
+        else:
+            t = _TextTree()
+        # Bound once, these run for every iris in the topology.
+        iris_label = "Iris {}".format
+        single_field = attrgetter(self.single_field) if self.single_field else None
+        delim = self.delim
         first_node = c()
         t.create_node("Topology at {}".format(self.time), first_node)
         for hub in self._hubs:
@@ -978,29 +1288,25 @@ class Discover:
                 getattr(hub, "fpga", "")),
                 thishubidx,
                 parent=first_node)
-            for (chidx, rrhs) in [(k, hub.chains[k]) for k in sorted(hub.chains.keys())]:
-                if type(rrhs) is not list:
-                    rrhs = [rrhs, ]
+            for (chidx, rrhs) in hub._sorted_chain_items:
                 for irises in rrhs:
                     if isinstance(irises, RRH) and irises.serial:
                         thischainidx = c()
                         t.create_node(
                             "Chain {}  Serial {}  Count {}  FW {} FPGA {} {}".format(
                                 chidx+1 if chidx < hub.LAST_POSSIBLE_CHAIN else "UNKNOWN",
-                                irises.serial, len(list(irises)),
-                                self.get_common(irises, 'firmware'),
-                                self.get_common(irises, 'fpga'),
+                                irises.serial, len(irises),
+                                *self.get_commons(irises, ('firmware', 'fpga')),
                                 "(FIX SFP CONFIG)" if not irises.config_correct else ""),
                             thischainidx,
                             parent=thishubidx,
                         )
-                        if self.single_field:
-                            iris_list = self.delim.join(
-                                str(getattr(iris, self.single_field)) for iris in irises)
+                        if single_field:
+                            iris_list = delim.join(map(str, map(single_field, irises)))
                             t.create_node(iris_list, parent=thischainidx)
                         else:
                             for iris in irises:
-                                t.create_node("Iris {}".format(iris), c(), parent=thischainidx)
+                                t.create_node(iris_label(iris), c(), parent=thischainidx)
                     elif irises is None:
                         continue
                     elif len(irises) > 0:
@@ -1009,21 +1315,18 @@ class Discover:
                             "Chain {}  Count: {} FW {} FPGA {}".format(
                                 chidx+1 if chidx < hub.LAST_POSSIBLE_CHAIN else "UNKNOWN",
                                 len(irises),
-                                self.get_common(irises.values(), 'firmware'),
-                                self.get_common(irises.values(), 'fpga')),
+                                *self.get_commons(irises.values(), ('firmware', 'fpga'))),
                             thischainidx,
                             parent=thishubidx,
                         )
-                        if self.single_field:
-                            iris_list = self.delim.join(
-                                str(getattr(iris, self.single_field))
-                                for iris in irises.values())
+                        if single_field:
+                            iris_list = delim.join(map(str, map(single_field, irises.values())))
                             t.create_node(iris_list, parent=thischainidx)
                         else:
-                            for j in [irises[k] for k in sorted(irises.keys())]:
-                                t.create_node("Iris {}".format(str(j)), c(), parent=thischainidx)
+                            for j in irises.values():
+                                t.create_node(iris_label(j), c(), parent=thischainidx)
 
-        if (len(self._standalone_irises + self._cpes + self._vgers)):
+        if self._clients:
             clients = c()
             t.create_node("Standalone Clients", clients, parent=first_node)
             self._display_stand_alone(t, clients, c, self._standalone_irises)
@@ -1034,12 +1337,15 @@ class Discover:
 
     def _as_yaml(self):
         import yaml
+        try:
+            # libyaml backed, falls back to the pure python dumper when missing.
+            from yaml import CSafeDumper as Dumper
+        except ImportError:
+            from yaml import SafeDumper as Dumper
         config = []
         for hub in self._hubs:
             hub_config = []
-            for (chidx, rrhs) in [(k, hub.chains[k]) for k in sorted(hub.chains.keys())]:
-                if type(rrhs) is not list:
-                    rrhs = [rrhs, ]
+            for (chidx, rrhs) in hub._sorted_chain_items:
                 for irises in rrhs:
                     if isinstance(irises, RRH) and irises.serial:
                         rrh_config = []
@@ -1047,13 +1353,13 @@ class Discover:
                             rrh_config.append(iris.serial)
                         hub_config.append({irises.serial: rrh_config})
                     elif len(irises) > 0:
-                        for j in [irises[k] for k in sorted(irises.keys())]:
+                        for j in irises.values():
                             hub_config.append(j.serial)
 
             config.append({hub.serial: hub_config})
-        for node in self._standalone_irises + self._cpes + self._vgers:
+        for node in self._clients:
             config.append(node.serial)
-        return yaml.dump(config)
+        return yaml.dump(config, Dumper=Dumper)
 
     def _as_json(self):
         bs_config = []
@@ -1062,9 +1368,7 @@ class Discover:
             rrh_serials_conf = []
             sdr_serials_conf = []
             calib_serials_conf = ""
-            for (chidx, rrhs) in [(k, hub.chains[k]) for k in sorted(hub.chains.keys())]:
-                if type(rrhs) is not list:
-                    rrhs = [rrhs, ]
+            for (chidx, rrhs) in hub._sorted_chain_items:
                 for iris_idx, irises in enumerate(rrhs):
                     if isinstance(irises, RRH) and irises.serial:
                         rrh_config = []
@@ -1074,7 +1378,7 @@ class Discover:
                             sdr_serials_conf.append(iris.serial)
 
                     elif len(irises) > 0:
-                        for j in [irises[k] for k in sorted(irises.keys())]:
+                        for j in irises.values():
                             hub_config.append(j.serial)
                             # sdr_serials_conf.append(j.serial)
                             calib_serials_conf = j.serial  # Calib nodes
@@ -1083,7 +1387,7 @@ class Discover:
             bs_config.append({cell_str: {"hub": hub.serial, "rrh": rrh_serials_conf, "sdr": sdr_serials_conf, "reference": calib_serials_conf}})
 
         ue_serials_conf = []
-        for node in self._standalone_irises + self._cpes + self._vgers:
+        for node in self._clients:
             ue_serials_conf.append(node.serial)
 
         config = []
@@ -1099,13 +1403,15 @@ class Discover:
             config = {"Clients": {"sdr" : ue_serials_conf}}
 
         # JSON filename
-        if self._json_filename.find('.json') == -1:
+        self._json_filename = os.fspath(self._json_filename)
+        if not self._json_filename.endswith('.json'):
             self._json_filename = self._json_filename + '.json'
 
+        as_json = json.dumps(config, indent = 4)
         with open(self._json_filename, 'w') as f:
-            json.dump(config, f, indent = 4)
+            f.write(as_json)
 
-        return json.dumps(config, indent = 4)
+        return as_json
 
     # To save more fields on the test dump, add the values to this dictionary.
     TEST_CONFIG_FORMAT = {
@@ -1121,38 +1427,52 @@ class Discover:
             "chain_index": None,
         },
     }
+    _MISSING = object()
+
+    @staticmethod
+    def _save_config(config, values_to_save : dict):
+        """
+            Projects config onto the keys of values_to_save, recursing where
+            the format has a nested dict and copying the value where it has None.
+            """
+        if (values_to_save is None or not hasattr(config, 'items')):
+            return config
+        retval = {}
+        # Walked with a stack of (config, format, output) levels, not recursion.
+        pending = [(config, values_to_save, retval)]
+        while pending:
+            source, spec, dest = pending.pop()
+            for key, value in spec.items():
+                found = source.get(key, Discover._MISSING)
+                if found is Discover._MISSING:
+                    continue
+                if value is None or not hasattr(found, 'items'):
+                    dest[key] = found
+                else:
+                    dest[key] = {}
+                    pending.append((found, value, dest[key]))
+        return retval
+
     def dump_for_test(self, filename):
         status = {}
         # Get the json data for each device.  Cannot use iter because some bugs will cause the
         # data to not be mapped correctly.
-        for dev in self._irises + self._cpes + self._vgers + self._hubs:
-            status[dev.serial] = {}
-            def save_config(config, values_to_save : dict):
-                if (values_to_save is None or not hasattr(config, 'items')):
-                    return config
-                retval = {}
-                for key, value in values_to_save.items():
-                    if key in config:
-                        retval[key] = save_config(config[key], values_to_save[key])
-                return retval
-            status[dev.serial] = save_config(dev._json, self.TEST_CONFIG_FORMAT)
-
+        for dev in itertools.chain(self._irises, self._cpes, self._vgers, self._hubs):
+            status[dev.serial] = self._save_config(dev._json, self.TEST_CONFIG_FORMAT)
+
+        # Encode in one shot, json.dump would issue a write per token.
+        as_json = json.dumps({
+            "status": status,
+            "enumerate": self._soapy_enumerate
+        }, indent=4)
         with open(filename, "w+") as fptr:
-            json.dump({
-                "status": status,
-                "enumerate": self._soapy_enumerate
-            }, fptr, indent=4)
+            fptr.write(as_json)
 
     def __iter__(self):
-        for hub in self._hubs:
-            for value in hub:
-                yield value
-        for iris in self._standalone_irises:
-            yield iris
-        for cpe in self._cpes:
-            yield cpe
-        for vger in self._vgers:
-            yield vger
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
 
     def set_credentials(self, username, password):
         for device in self:
@@ -1168,13 +1488,14 @@ class Discover:
                   item is not power-dependent on the prior.
                   """
             if isinstance(item, IrisRemote):
-                index = getattr(item, "rrh_index", 0) or 0
-                chain = getattr(item, "chain_index", 0) or 0
-                value = [0 - chain, 0 - index]
+                # IrisRemote always sets these, they are None until fetched.
+                index = item.rrh_index or 0
+                chain = item.chain_index or 0
+                value = (0 - chain, 0 - index)
             elif isinstance(item, HubRemote):
-                value = [1, 0]
+                value = (1, 0)
             else:
-                value = [2, 0]
+                value = (2, 0)
             return value
 
     class Filters:
@@ -1183,10 +1504,10 @@ class Discover:
         # filter it out in argparse below in a simple way.
         @staticmethod
         def SAME_CHAIN(item1):
+            item1_is_iris = isinstance(item1, IrisRemote)
 
             def filtering(item2):
-                if not isinstance(item1, IrisRemote) or not isinstance(
-                    item2, IrisRemote):
+                if not item1_is_iris or not isinstance(item2, IrisRemote):
                     return False
                 return item1.chain is item2.chain
 
@@ -1195,19 +1516,22 @@ class Discover:
         @staticmethod
         def RELATED_TO(item1):
 
+            # Everything that depends only on item1 is worked out once here
+            # rather than for every candidate.
+            same_chain = Discover.Filters.SAME_CHAIN(item1)
+            item1_is_hub = isinstance(item1, HubRemote)
+            item1_hub = item1.hub if isinstance(item1, (IrisRemote, RRH)) else None
+
             def filtering(item2):
                 if item2 is item1:
                     return True
-                if Discover.Filters.SAME_CHAIN(item1)(item2):
-                    return True
-                hub_test = lambda z: lambda x, y: (y.hub is x) if isinstance(
-                    x, HubRemote) and isinstance(y, z) else False
-                # RRH and Hubs are related
-                if hub_test(IrisRemote)(item1, item2) or hub_test(IrisRemote)(item2,
-                                                                              item1):
-                    return True
-                if hub_test(RRH)(item1, item2) or hub_test(RRH)(item2, item1):
+                if same_chain(item2):
                     return True
+                # Irises and RRHs are related to their hub
+                if item1_is_hub and isinstance(item2, (IrisRemote, RRH)):
+                    return item2.hub is item1
+                if item1_hub is not None:
+                    return item2 is item1_hub
                 return False
 
             return filtering
@@ -1226,18 +1550,12 @@ class Discover:
 
         @staticmethod
         def IRIS_STANDALONE(item):
-            if not Discover.Filters.IRIS(item):
-                return False
-            return item.rrh_member is False and item.hub is None
+            return isinstance(item, IrisRemote) and item.rrh_member is False and item.hub is None
 
         @staticmethod
         def IRIS_RRHMEMBER(item):
-            if not Discover.Filters.IRIS(item):
-                return False
-            return item.rrh_member is True and item.hub is not None
+            return isinstance(item, IrisRemote) and item.rrh_member is True and item.hub is not None
 
         @staticmethod
         def IRIS_PARTIALCHAIN(item):
-            if not Discover.Filters.IRIS(item):
-                return False
-            return item.rrh_member is False and item.hub is not None
+            return isinstance(item, IrisRemote) and item.rrh_member is False and item.hub is not None
@@ -11,8 +11,11 @@ import asyncio
 from pyfaros.discover.discover import Remote
 
 async def async_do_reboot(devices, recursive=False, force=False):
-    for device in devices:
-        await device.async_do_reboot(recursive=recursive)
+    try:
+        for device in devices:
+            await device.async_do_reboot(recursive=recursive)
+    finally:
+        await Remote.close_pool()
 
 def do_reboot(devices, recursive=False, force=False):
     loop = asyncio.get_event_loop()
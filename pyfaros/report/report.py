@@ -126,6 +126,8 @@ async def async_do_report(output_dir, devices : [discover.Remote] or None, recur
         ],
         return_exceptions=True)
 
+    await discover.Remote.close_pool()
+
     exceptions = [e for e in return_values if isinstance(e, Exception)]
     if exceptions:
         logging.error(exceptions)
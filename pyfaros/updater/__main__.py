@@ -13,6 +13,7 @@ import sys
 import argparse
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable
 
 from pyfaros.updater.updater import do_update, do_update_and_wait
@@ -31,6 +32,39 @@ async def update_devices(environment: UpdateEnvironment, devices: Iterable[Remot
             logging.error('Failed to reach devices within {} seconds after reboot'.format(timeout))
 
 
+def _build_variant_remaps():
+    """
+        Returns (from variant, to variant, help) for every image remap the
+        updater supports, used both to add the --treat-X-as-Y options and to
+        apply the ones given.
+        """
+    extra_helps = {
+        "hub:som6": "  WARNING: Choosing the wrong type will cause the HUB to not boot and the SD will need to be externally re-imaged.",
+        "hub:som9": "  WARNING: Choosing the wrong type will cause the HUB to not boot and the SD will need to be externally re-imaged.",
+        "iris030_ue:iris030_sdr": "  WARNING: If the Iris is plugged in to 1 GbE fiber this WILL BREAK CONNECTIVITY to the Iris.",
+    }
+    remaps = []
+    for device in [IrisRemote, CPERemote, HubRemote, VgerRemote]:
+        for v1 in device.Variant:
+            # Enum order, so the options and the remaps are the same every run.
+            support_to = getattr(v1, 'support_to', [v for v in device.Variant if v is not v1])
+            for v2 in support_to:
+                if v1 in getattr (v2, 'support_from', device.Variant):
+                    extra_help = extra_helps.get("{}:{}".format(v1.value, v2.value), "")
+                    devname = device.__name__.strip("Remote")
+                    devname_pl = devname + ("es" if devname.endswith('s') else "s")
+                    help_str = "For {} currently on a {} image, apply a {} image.{}".format(
+                        devname_pl, v1.value, v2.value, extra_help)
+                    # REVISIT: This is a hacky way of having specialized help for the HUB.
+                    if not getattr(v1, 'support_from', True):
+                        help_str = "Apply the {} image to the {}.{}".format(v2.value, v1.value, extra_help)
+                    remaps.append((v1, v2, help_str))
+    return tuple(remaps)
+
+
+_VARIANT_REMAPS = _build_variant_remaps()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
             prog="python3 -m pyfaros.updater",
@@ -123,32 +157,25 @@ if __name__ == '__main__':
         action='store_true',
         default=False)
 
-    extra_helps = {
-        "hub:som6": "  WARNING: Choosing the wrong type will cause the HUB to not boot and the SD will need to be externally re-imaged.",
-        "hub:som9": "  WARNING: Choosing the wrong type will cause the HUB to not boot and the SD will need to be externally re-imaged.",
-        "iris030_ue:iris030_sdr": "  WARNING: If the Iris is plugged in to 1 GbE fiber this WILL BREAK CONNECTIVITY to the Iris.",
-    }
-    for device in [IrisRemote, CPERemote, HubRemote, VgerRemote]:
-        for v1 in device.Variant:
-            support_to = getattr(v1, 'support_to', list(set(device.Variant) - {v1}))
-            for v2 in support_to:
-                if v1 in getattr (v2, 'support_from', device.Variant):
-                    extra_help = extra_helps.get("{}:{}".format(v1.value, v2.value), "")
-                    devname = device.__name__.strip("Remote")
-                    devname_pl = devname + ("es" if devname.endswith('s') else "s")
-                    help_str = "For {} currently on a {} image, apply a {} image.{}".format(
-                        devname_pl, v1.value, v2.value, extra_help)
-                    # REVISIT: This is a hacky way of having specialized help for the HUB.
-                    if not getattr(v1, 'support_from', True):
-                        help_str = "Apply the {} image to the {}.{}".format(v2.value, v1.value, extra_help)
-                    device_type_options.add_argument(
-                        '--treat-{}-as-{}'.format(v1.value, v2.value),
-                        help=help_str,
-                        action="store_true",
-                        default=False)
+    for v1, v2, help_str in _VARIANT_REMAPS:
+        device_type_options.add_argument(
+            '--treat-{}-as-{}'.format(v1.value, v2.value),
+            help=help_str,
+            action="store_true",
+            default=False)
 
     args = parser.parse_args()
 
+    # Target variant by source variant, each source can only take one image.
+    remaps = {}
+    for v1, v2, _ in _VARIANT_REMAPS:
+        if getattr(args, 'treat_{}_as_{}'.format(v1.value, v2.value), False):
+            remaps.setdefault(v1, []).append(v2)
+    for v1, targets in remaps.items():
+        if len(targets) > 1:
+            parser.error("only one of {} may be given".format(", ".join(
+                '--treat-{}-as-{}'.format(v1.value, v2.value) for v2 in targets)))
+
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
@@ -182,50 +209,50 @@ if __name__ == '__main__':
             logging.debug(args)
 
             logging.debug("Looking for remaps, and remapping")
-            for device in [IrisRemote, CPERemote, HubRemote, VgerRemote]:
-                for v1 in device.Variant:
-                    for v2 in device.Variant:
-                        # Just use the existing of the attrbiute to determine if the operation is supported
-                        remap_name = 'treat_{}_as_{}'.format(v1.value, v2.value)
-                        remap_wanted = getattr(args, remap_name, False)
-                        if remap_wanted:
-                            logging.debug("Did remap for {} to {}".format(v1.value, v2.value))
-                            update_environment.mapping[v1] = update_environment.mapping[v2]
+            for v1, (v2, ) in remaps.items():
+                logging.debug("Did remap for %s to %s", v1.value, v2.value)
+                update_environment.mapping[v1] = update_environment.mapping[v2]
 
             top = Discover()
             discovered = sorted(
                 filter(update_environment.availablefilter(),
                        list(top)),
                 key=Discover.Sortings.POWER_DEPENDENCY)
-            logging.debug("Discovered objects: {}".format(discovered))
+            # Lazily formatted, the device list repr is only worth building when debugging.
+            logging.debug("Discovered objects: %s", discovered)
 
+            wanted_serials = set(args.serial)
             if args.recursive:
                 for device in top:
-                    if device.serial in args.serial:
-                        for child_device in device.walk():
-                            if child_device.serial not in args.serial:
-                                args.serial.append(child_device.serial)
+                    if device.serial in wanted_serials:
+                        wanted_serials.update(
+                            child_device.serial for child_device in device.walk())
 
             if not args.patch_all:
-                discovered = list(filter(lambda x: x.serial in args.serial, discovered))
+                discovered = [x for x in discovered if x.serial in wanted_serials]
             elif args.standalone:
-                discovered = list(
-                    filter(
-                        lambda x: x.rrh is None,
-                        filter(lambda x: isinstance(x, IrisRemote),
-                               discovered)))
-            logging.debug("Filtered discovered objects: {}".format(discovered))
-            logging.info("About to flash devices:")
-            for device in discovered:
+                discovered = [
+                    x for x in discovered if isinstance(x, IrisRemote) and x.rrh is None
+                ]
+            logging.debug("Filtered discovered objects: %s", discovered)
+
+            # Enabling sudo and detecting hub variants block on ssh, do the
+            # devices side by side.
+            def prepare(device):
                 device.set_credentials(args.user, args.password)
                 if args.enable_sudo:
                     device.enable_sudo()
                 device.set_variant()
+
+            if discovered:
+                with ThreadPoolExecutor(max_workers=min(len(discovered), 16)) as pool:
+                    list(pool.map(prepare, discovered))
+            logging.info("About to flash devices:")
+            for device in discovered:
+                files = update_environment.mapping[device.variant]
                 logging.info("\t {} - {}\n\t\t{}\n\t\t{}\n\t\t{}".format(
                     device.serial, device.address,
-                    update_environment.mapping[device.variant].bootbin,
-                    update_environment.mapping[device.variant].bootbit,
-                    update_environment.mapping[device.variant].imageub))
+                    files.bootbin, files.bootbit, files.imageub))
             if not args.dry_run:
                 loop = asyncio.get_event_loop()
                 loop.run_until_complete(update_devices(update_environment, discovered, args))
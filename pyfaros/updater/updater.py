@@ -134,63 +134,67 @@ async def do_reboot(device):
 
 async def do_update(context, devices, store_ssh=False):
     this_update_timestamp = str(time.time()).split('.')[0]
-    async with Remote.sshify(devices):
-        cmap_list = lambda d: [
-            context.mapping[d.variant].bootbin,
-            context.mapping[d.variant].imageub
-        ] if (isinstance(d, IrisRemote) or isinstance(
-            d, HubRemote)) else [
-            context.mapping[d.variant].bootbit,
-            context.mapping[d.variant].imageub
-        ]
-
-        copy_exceptions = await asyncio.gather(
-            *[
-                transfer_files(d, cmap_list(d), this_update_timestamp)
-                for d in devices
-            ],
-            return_exceptions=True)
-
-        copy_exceptions = [e for e in copy_exceptions if isinstance(e, Exception)]
-        logging.debug(copy_exceptions)
-
-        if len(copy_exceptions) > 0:
-            raise UpdateError(copy_exceptions)
-
-        mount_exceptions = await asyncio.gather(
-            *[mount_boot(d) for d in devices], return_exceptions=True)
-
-        mount_exceptions = [e for e in mount_exceptions if isinstance(e, Exception)]
-        logging.debug(mount_exceptions)
-
-        if len(mount_exceptions) > 0:
-            raise UpdateError(mount_exceptions)
-
-        replace_exceptions = await asyncio.gather(
-            *[
-                replace_files(d, cmap_list(d), this_update_timestamp, store_ssh=store_ssh)
-                for d in devices
-            ],
-            return_exceptions=True)
+    try:
+        async with Remote.sshify(devices):
+            cmap_list = lambda d: [
+                context.mapping[d.variant].bootbin,
+                context.mapping[d.variant].imageub
+            ] if (isinstance(d, IrisRemote) or isinstance(
+                d, HubRemote)) else [
+                context.mapping[d.variant].bootbit,
+                context.mapping[d.variant].imageub
+            ]
+
+            copy_exceptions = await asyncio.gather(
+                *[
+                    transfer_files(d, cmap_list(d), this_update_timestamp)
+                    for d in devices
+                ],
+                return_exceptions=True)
+
+            copy_exceptions = [e for e in copy_exceptions if isinstance(e, Exception)]
+            logging.debug(copy_exceptions)
+
+            if len(copy_exceptions) > 0:
+                raise UpdateError(copy_exceptions)
+
+            mount_exceptions = await asyncio.gather(
+                *[mount_boot(d) for d in devices], return_exceptions=True)
+
+            mount_exceptions = [e for e in mount_exceptions if isinstance(e, Exception)]
+            logging.debug(mount_exceptions)
+
+            if len(mount_exceptions) > 0:
+                raise UpdateError(mount_exceptions)
+
+            replace_exceptions = await asyncio.gather(
+                *[
+                    replace_files(d, cmap_list(d), this_update_timestamp, store_ssh=store_ssh)
+                    for d in devices
+                ],
+                return_exceptions=True)
         
-        replace_exceptions = [e for e in replace_exceptions if isinstance(e, Exception)]
-        logging.debug(replace_exceptions)
+            replace_exceptions = [e for e in replace_exceptions if isinstance(e, Exception)]
+            logging.debug(replace_exceptions)
 
-        if len(replace_exceptions) > 0:
-            raise UpdateError(replace_exceptions)
+            if len(replace_exceptions) > 0:
+                raise UpdateError(replace_exceptions)
 
-        for device in devices:
-            await do_reboot(device)
+            for device in devices:
+                await do_reboot(device)
+    finally:
+        await Remote.close_pool()
 
 
 async def find_devices(devices: Iterable[Remote]) -> bool:
     found_devices = await asyncio.get_event_loop().run_in_executor(None, SoapySDR.Device.enumerate)
+    # SoapySDRKwargs only promises the mapping basics, no get().
+    found_serials = {found_dict['serial'] for found_dict in found_devices if 'serial' in found_dict}
 
     def find(device: Remote):
-        for found_dict in found_devices:
-            if 'serial' in found_dict and found_dict['serial'] == device.serial:
-                log.info('Found device {}'.format(device.serial))
-                return True
+        if device.serial in found_serials:
+            log.info('Found device {}'.format(device.serial))
+            return True
         return False
 
     return all(find(device) for device in devices)
@@ -8,12 +8,13 @@
 #	DEALINGS IN THE SOFTWARE.
 #
 # Copyright (c) 2020, 2021 Skylark Wireless.
+import asyncio
 import copy
 import unittest.mock
 import os
 import site
+import time
 import json
-import yaml
 
 filepath = os.path.dirname(os.path.abspath(__file__))
 site.addsitedir(os.path.join(filepath, '..', '..'))
@@ -23,8 +24,19 @@ from test.utils import mock_imports
 with unittest.mock.patch('builtins.__import__', side_effect=mock_imports(["SoapySDR", ])):
     from pyfaros.discover import discover
 
-@unittest.mock.patch("time.sleep", autospec=True)
+# The scans only need staggering against real avahi, not the mocked enumerate.
+@unittest.mock.patch.object(discover.Discover, "SCAN_STAGGER", 0)
 class TestDiscover(unittest.TestCase):
+    # Parsed fixtures, shared across tests; hand out copies since tests edit them.
+    _fixtures = {}
+
+    @classmethod
+    def load_fixture(cls, name):
+        if name not in cls._fixtures:
+            with open(os.path.join(filepath, name), "r") as fptr:
+                cls._fixtures[name] = json.load(fptr)
+        return copy.deepcopy(cls._fixtures[name])
+
     def setUp(self) -> None:
         self.maxDiff = None
 
@@ -43,7 +55,8 @@ class TestDiscover(unittest.TestCase):
             if hub.error:
                 hub_data["error"] = True
             retval["hubs"].append(hub_data)
-            for (chidx, rrhs) in [(k, hub.chains[k]) for k in sorted(hub.chains.keys())]:
+            # Chain indexes are unique, so the sort never compares the chains.
+            for (chidx, rrhs) in sorted(hub.chains.items()):
                 if type(rrhs) is not list:
                     rrhs = [rrhs, ]
                 for irises in rrhs:
@@ -59,14 +72,14 @@ class TestDiscover(unittest.TestCase):
                         hub_data["chains"][chidx_s] = rrh_data
                     if isinstance(irises, discover.RRH) and irises.serial:
                         rrh_data["serial"] = irises.serial
+                        # Nodes sharing an index are listed together, lone nodes are bare serials.
+                        nodes = {}
                         for iris in irises:
-                            node_index = str(iris.rrh_index+1)
-                            if node_index in rrh_data["nodes"]:
-                                if type(rrh_data["nodes"][node_index]) != list:
-                                    rrh_data["nodes"][node_index] = [rrh_data["nodes"][node_index], ]
-                                rrh_data["nodes"][node_index].append(iris.serial)
-                            else:
-                                rrh_data["nodes"][node_index] = iris.serial
+                            nodes.setdefault(str(iris.rrh_index+1), []).append(iris.serial)
+                        rrh_data["nodes"] = {
+                            node_index: serials[0] if len(serials) == 1 else serials
+                            for node_index, serials in nodes.items()
+                        }
                     else:
                         for rrh_index, iris in irises.items():
                             rrh_data["nodes"][str(rrh_index+1)] = iris.serial
@@ -93,7 +106,7 @@ class TestDiscover(unittest.TestCase):
         def enumerate(self, _):
             return self._devices
 
-    def run_with_config(self, test_config):
+    def run_with_config(self, test_config, use_create=False, **discover_kwargs):
         async def mock_afetch(dev):
             dev._json = test_config["status"].get(dev.serial, {})
             return dev
@@ -102,13 +115,21 @@ class TestDiscover(unittest.TestCase):
                                         self.Device(test_config["enumerate"])) as SoapyDevice, \
              unittest.mock.patch.object(discover.Remote, "afetch", mock_afetch), \
              unittest.mock.patch.object(discover.HubRemote, "_update_irises", autospec=True, return_value=None):
-            devices = discover.Discover()
+            if use_create:
+                loop = asyncio.new_event_loop()
+                try:
+                    devices = loop.run_until_complete(discover.Discover.create(**discover_kwargs))
+                finally:
+                    loop.close()
+            else:
+                devices = discover.Discover(**discover_kwargs)
         print()
         print(devices)
         output = self.convert_discover_to_dict(devices)
         print(json.dumps(output, indent=4))
         self.assertDictEqual(test_config["expected_devices"], output)
         if "as_yaml" in test_config:
+            import yaml
             as_yaml = devices._as_yaml()
             print("yaml:\n{}".format(as_yaml))
             expected = '\n'.join(test_config["as_yaml"])
@@ -118,25 +139,21 @@ class TestDiscover(unittest.TestCase):
 
         return devices
 
-    def test_discover(self, _):
-        with open(os.path.join(filepath, "test_discover.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_discover(self):
+        test_config = self.load_fixture("test_discover.json")
         devices = self.run_with_config(test_config)
 
-    def test_partial_discover(self, _):
-        with open(os.path.join(filepath, "test_partial_discover.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_partial_discover(self):
+        test_config = self.load_fixture("test_partial_discover.json")
         self.run_with_config(test_config)
 
-    def test_discover_chain_5(self, _):
-        with open(os.path.join(filepath, "test_discover_chain_5.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_discover_chain_5(self):
+        test_config = self.load_fixture("test_discover_chain_5.json")
         self.run_with_config(test_config)
 
-    def test_discover_with_bad_rrh_index(self, _):
+    def test_discover_with_bad_rrh_index(self):
         # Reproduce https://gitlab.com/skylark-wireless/software/sklk-dev/-/issues/191
-        with open(os.path.join(filepath, "test_discover_chain_5.json"), "r") as fptr:
-            test_config = json.load(fptr)
+        test_config = self.load_fixture("test_discover_chain_5.json")
         # Modify the chain output to reproduce a sklk-dev bug where the chain and message indexes are wrong
         for node in test_config["status"].values():
             if "message_index" in node["global"].keys():
@@ -152,10 +169,9 @@ class TestDiscover(unittest.TestCase):
         hub_0["error"] = True
         self.run_with_config(test_config)
 
-    def test_discover_with_no_hub(self, _):
+    def test_discover_with_no_hub(self):
         # Reproduce https://gitlab.com/skylark-wireless/software/sklk-dev/-/issues/191
-        with open(os.path.join(filepath, "test_discover_chain_5.json"), "r") as fptr:
-            test_config = json.load(fptr)
+        test_config = self.load_fixture("test_discover_chain_5.json")
         # Modify the chain output to reproduce a sklk-dev bug where the chain and message indexes are wrong
         test_config["enumerate"] = [node for node in test_config["enumerate"] if node["serial"] != "FH4A000005"]
         test_config["expected_devices"]["iris"] = \
@@ -163,10 +179,9 @@ class TestDiscover(unittest.TestCase):
         del test_config["expected_devices"]["hubs"][0]
         self.run_with_config(test_config)
 
-    def test_discover_with_no_head(self, _):
+    def test_discover_with_no_head(self):
         # Reproduce https://gitlab.com/skylark-wireless/software/sklk-dev/-/issues/191
-        with open(os.path.join(filepath, "test_discover_chain_5.json"), "r") as fptr:
-            test_config = json.load(fptr)
+        test_config = self.load_fixture("test_discover_chain_5.json")
         # Modify the chain output to reproduce a sklk-dev bug where the chain and message indexes are wrong
         test_config["enumerate"] = [node for node in test_config["enumerate"] if node["serial"] != "RF3E000336"]
         hub_0 = test_config["expected_devices"]["hubs"][0]
@@ -176,17 +191,111 @@ class TestDiscover(unittest.TestCase):
         hub_0["error"] = True
         self.run_with_config(test_config)
 
-    def test_discover_double_chain(self, _):
-        with open(os.path.join(filepath, "discover-double-chain.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_discover_double_chain(self):
+        test_config = self.load_fixture("discover-double-chain.json")
         self.run_with_config(test_config)
 
-    def test_discover_2020_06_incompatible(self, _):
-        with open(os.path.join(filepath, "discover-2020-06-incompatible.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_discover_2020_06_incompatible(self):
+        test_config = self.load_fixture("discover-2020-06-incompatible.json")
         self.run_with_config(test_config)
 
-    def test_discover_daisy_chain(self, _):
-        with open(os.path.join(filepath, "discover_daisy_chain.json"), "r") as fptr:
-            test_config = json.load(fptr)
+    def test_discover_daisy_chain(self):
+        test_config = self.load_fixture("discover_daisy_chain.json")
         self.run_with_config(test_config)
+
+    def test_discover_progress(self):
+        test_config = self.load_fixture("test_discover_chain_5.json")
+        reported = []
+        devices = self.run_with_config(test_config, progress=reported.append)
+        remotes = devices._irises + devices._hubs + devices._cpes + devices._vgers
+        self.assertEqual(len(remotes), len(reported))
+        self.assertEqual(set(map(id, remotes)), set(map(id, reported)))
+
+    def test_discover_create(self):
+        test_config = self.load_fixture("test_discover_chain_5.json")
+        self.run_with_config(test_config, use_create=True)
+
+    def test_discover_scan_error_cancels_fetches(self):
+        test_config = self.load_fixture("test_discover_chain_5.json")
+        calls = []
+        started = []
+        cancelled = []
+
+        def enumerate(_):
+            calls.append(None)
+            if len(calls) == 1:
+                return test_config["enumerate"]
+            # Fail after the first scan's fetches are under way.
+            time.sleep(0.05)
+            raise RuntimeError("scan failed")
+
+        async def hung_afetch(dev):
+            started.append(dev)
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(dev)
+                raise
+
+        with unittest.mock.patch.object(discover.SoapySDR.Device, "enumerate", enumerate, create=True), \
+             unittest.mock.patch.object(discover.Remote, "afetch", hung_afetch):
+            with self.assertRaises(RuntimeError):
+                discover.Discover(soapy_enumerate_iterations=2)
+        self.assertTrue(started)
+        self.assertEqual(started, cancelled)
+
+    class Response(object):
+        def __init__(self, status, body=b"", headers=None):
+            self.status = status
+            self.headers = headers or {}
+            self._body = body
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc):
+            return False
+        async def read(self):
+            return self._body
+        def raise_for_status(self):
+            pass
+
+    class Session(object):
+        def __init__(self, responses):
+            self._responses = list(responses)
+            self.requests = []
+        def get(self, url, headers=None):
+            self.requests.append(headers)
+            return self._responses.pop(0)
+
+    def test_afetch_not_modified(self):
+        url = "http://192.0.2.1/status"
+        session = self.Session([
+            self.Response(200, b'{"global": {"chain_index": 1}}', {"ETag": "abc"}),
+            self.Response(304),
+        ])
+
+        async def get_session():
+            return session
+
+        first = discover.Remote({"serial": "RF3E000001"})
+        second = discover.Remote({"serial": "RF3E000001"})
+        first._json_url = second._json_url = url
+        loop = asyncio.new_event_loop()
+        with unittest.mock.patch.object(discover.Remote, "_json_cache", discover.OrderedDict()), \
+             unittest.mock.patch.object(discover.Remote, "get_session", get_session):
+            try:
+                loop.run_until_complete(first.afetch())
+                loop.run_until_complete(second.afetch())
+            finally:
+                loop.close()
+        self.assertEqual({}, session.requests[0])
+        self.assertEqual({"If-None-Match": "abc"}, session.requests[1])
+        self.assertEqual(first._json, second._json)
+        # Each remote gets its own json, not the cached object.
+        second._json["global"]["chain_index"] = 2
+        self.assertEqual(1, first._json["global"]["chain_index"])
+
+    def test_mac_to_uaa_id(self):
+        # Low 24 bits byte reversed, the upper bytes of the mac are dropped.
+        self.assertEqual(0xefcdab, discover.Remote.mac_to_uaa_id(0x001122abcdef))
+        self.assertEqual(0x000001, discover.Remote.mac_to_uaa_id(0x010000))
+        self.assertEqual(0, discover.Remote.mac_to_uaa_id(0))